@@ -5,8 +5,9 @@ https://manual.gromacs.org/5.1.1/user-guide/file-formats.html#gro
 """
 
 import argparse
+import concurrent.futures
+import functools
 import pathlib
-from unicodedata import unidata_version
 import warnings
 
 
@@ -73,6 +74,14 @@ def get_cli_arguments():
         help="Path to save results",
         required=True,
     )
+    parser.add_argument(
+        "-w",
+        "--max-workers",
+        action="store",
+        type=int,
+        help="Number of processes used to parse files (default: all CPU cores)",
+        default=None,
+    )
     return parser.parse_args()
 
 
@@ -231,27 +240,30 @@ if __name__ == "__main__":
 
     gro_info_lst = []
     parsing_error_counter = 0
-    pbar = tqdm.tqdm(
-        GRO_FILES_LST,
-        leave=True,
-        bar_format="{l_bar}{n_fmt}/{total_fmt} [{elapsed}<{remaining}]{postfix}",
+    # Files are independent from each other: parse them on all CPU cores.
+    extract_info = functools.partial(
+        extract_info_from_gro,
+        target_path=args.input,
+        protein_residues=PROTEIN_RESIDUES,
+        lipid_residues=LIPID_RESIDUES,
+        nucleic_residues=NUCLEIC_RESIDUES,
+        water_ion_residues=WATER_ION_RESIDUES,
+        glucid_residues=GLUCID_RESIDUES,
     )
-    for gro_file_name in pbar:
-        pbar.set_postfix({"file": str(gro_file_name)})
-        # pbar.set_description(f"Reading {gro_file_name}", refresh=True)
-        gro_info = extract_info_from_gro(
-            gro_file_name,
-            args.input,
-            PROTEIN_RESIDUES,
-            LIPID_RESIDUES,
-            NUCLEIC_RESIDUES,
-            WATER_ION_RESIDUES,
-            GLUCID_RESIDUES,
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.max_workers
+    ) as executor:
+        pbar = tqdm.tqdm(
+            executor.map(extract_info, GRO_FILES_LST, chunksize=16),
+            total=GRO_FILE_NUMBER,
+            leave=True,
+            bar_format="{l_bar}{n_fmt}/{total_fmt} [{elapsed}<{remaining}]",
         )
-        if gro_info["dataset_origin"] != "error":
-            gro_info_lst.append(gro_info)
-        else:
-            parsing_error_counter += 1
+        for gro_info in pbar:
+            if gro_info["dataset_origin"] != "error":
+                gro_info_lst.append(gro_info)
+            else:
+                parsing_error_counter += 1
     gro_info_df = pd.DataFrame(gro_info_lst)
     result_file_path = pathlib.Path(args.output) / "gromacs_gro_files_info.tsv"
     gro_info_df.to_csv(result_file_path, sep="\t", index=False)
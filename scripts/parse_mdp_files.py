@@ -7,6 +7,8 @@ https://manual.gromacs.org/5.1.1/user-guide/file-formats.html#mdp
 """
 
 import argparse
+import concurrent.futures
+import functools
 import pathlib
 import re
 
@@ -49,6 +51,14 @@ def get_cli_arguments():
         help="Path to save results",
         required=True,
     )
+    parser.add_argument(
+        "-w",
+        "--max-workers",
+        action="store",
+        type=int,
+        help="Number of processes used to parse files (default: all CPU cores)",
+        default=None,
+    )
     return parser.parse_args()
 
 
@@ -152,16 +162,18 @@ if __name__ == "__main__":
     MDP_FILES_LST = find_all_files(ARGS.input, FILE_TYPE)
     print(f"Found {len(MDP_FILES_LST)} {FILE_TYPE} files in {ARGS.input}")
 
-    mdp_info_lst = []
-    pbar = tqdm(
-        MDP_FILES_LST,
-        leave=True,
-        bar_format="{l_bar}{n_fmt}/{total_fmt} [{elapsed}<{remaining}]{postfix}",
-    )
-    for mdp_file_name in pbar:
-        pbar.set_postfix({"file": str(mdp_file_name)})
-        mdp_info = extract_info_from_mdp(mdp_file_name, ARGS.input)
-        mdp_info_lst.append(mdp_info)
+    # Files are independent from each other: parse them on all CPU cores.
+    extract_info = functools.partial(extract_info_from_mdp, target_path=ARGS.input)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=ARGS.max_workers
+    ) as executor:
+        pbar = tqdm(
+            executor.map(extract_info, MDP_FILES_LST, chunksize=16),
+            total=len(MDP_FILES_LST),
+            leave=True,
+            bar_format="{l_bar}{n_fmt}/{total_fmt} [{elapsed}<{remaining}]",
+        )
+        mdp_info_lst = list(pbar)
     mdp_info_df = pd.DataFrame(mdp_info_lst)
     result_file_path = pathlib.Path(ARGS.output) / "gromacs_mdp_files_info.tsv"
     mdp_info_df.to_csv(result_file_path, sep="\t", index=False)
@@ -88,30 +88,38 @@ def find_false_positive_datasets(filename, md_file_types):
     """
     df = pd.read_csv(filename, sep="\t")
     df["file_type"] = df["file_type"].astype(str)
-    unique_file_types_per_dataset = (df
-        .groupby("dataset_id")["file_type"]
-        .agg(["count", "unique"])
+    df["is_md_file"] = df["file_type"].isin(md_file_types)
+    df["is_zip_file"] = df["file_type"] == "zip"
+    datasets = (df
+        .groupby("dataset_id")
+        .agg(
+            count=("file_type", "count"),
+            has_md_file=("is_md_file", "any"),
+            only_zip_files=("is_zip_file", "all"),
+        )
         .sort_values(by="count", ascending=False)
     )
+    # Datasets that only contain zip files might have not been properly
+    # parsed by the scrapper or zip preview is not available.
+    # In case of doubt, we keep these datasets.
+    for index in datasets[datasets["only_zip_files"]].index:
+        print(f"Dataset {index} contains only zip files -> keep")
+    # For a fiven dataset, if there is no MD file types in the entire set
+    # of the dataset file types, then we might have a false-positive dataset.
+    candidates = datasets[~datasets["has_md_file"] & ~datasets["only_zip_files"]]
+    # We print the total number of files in the dataset
+    # and the first 20 file types for extra verification.
+    unique_file_types_per_dataset = (df[df["dataset_id"].isin(candidates.index)]
+        .groupby("dataset_id")["file_type"]
+        .unique()
+    )
     false_positives = []
-    for index in unique_file_types_per_dataset.index:
-        file_types = list(unique_file_types_per_dataset.loc[index, "unique"])
-        number_files = unique_file_types_per_dataset.loc[index, "count"]
-        # Datasets that only contain zip files might have not been properly
-        # parsed by the scrapper or zip preview is not available.
-        # In case of doubt, we keep these datasets.
-        if file_types == ["zip"]:
-            print(f"Dataset {index} contains only zip files -> keep")
-            continue
-        # For a fiven dataset, if there is no MD file types in the entire set 
-        # of the dataset file types, then we might have a false-positive dataset.
-        # We print the total number of files in the dataset
-        # and the first 20 file types for extra verification.
-        if len(set(file_types) & set(md_file_types)) == 0:
-            print(f"Dataset {index} might be a false positive ({number_files} files)")
-            print(" ".join(file_types[:20]))
-            print("---")
-            false_positives.append(index)
+    for index, number_files in candidates["count"].items():
+        file_types = list(unique_file_types_per_dataset[index])
+        print(f"Dataset {index} might be a false positive ({number_files} files)")
+        print(" ".join(file_types[:20]))
+        print("---")
+        false_positives.append(index)
     return false_positives
 
 
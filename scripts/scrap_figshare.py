@@ -1,38 +1,27 @@
 """Scrap molecular dynamics datasets and files from FigShare."""
 
+import collections
+import concurrent.futures
 from datetime import datetime
+import functools
 import json
-import os
 import pathlib
-import re
 import time
 
 
 import numpy as np
 import pandas as pd
-import requests
 
 
 import toolbox
 
 
-def extract_date(date_str):
-    """Extract and format date from a string.
-
-    Parameters
-    ----------
-    date_str : str
-        Date as a string in ISO 8601.
-        For example: 2020-07-29T19:22:57.752335+00:00
-
-    Returns
-    -------
-    str
-        Date as in string in YYYY-MM-DD format.
-        For example: 2020-07-29
-    """
-    date = datetime.fromisoformat(date_str)
-    return f"{date:%Y-%m-%d}"
+DATASET_ORIGIN = "figshare"
+FIGSHARE_API_URL = "https://api.figshare.com/v2"
+FIGSHARE_STATS_URL = "https://stats.figshare.com/total"
+FIGSHARE_DOWNLOAD_URL = "https://figshare.com/ndownloader/files"
+# Reuse connections to the API between requests.
+HTTP_SESSION = toolbox.create_http_session()
 
 
 def extract_files_from_response(json_dic, file_list):
@@ -71,23 +60,21 @@ def extract_data_from_figshare_zip_file(url):
     list
         List of dictionnaries with data extracted from zip preview.
     """
-    response = requests.get(url)
+    response = HTTP_SESSION.get(url)
 
     if response.status_code != 200:
         print(f"Status code: {response.status_code}")
         print(response.headers)
         print(url)
         return {}
-    file_list_json = response.json()
+    file_list_json = toolbox.decode_json_response(response)
     file_list = extract_files_from_response(file_list_json, [])
     file_lst = []
     for idx, file in enumerate(file_list):
         file_name = file.strip()
         file_size = np.nan
         file_dict = {"file_name": file_name, "file_size": np.nan}
-        file_dict["file_type"] = "none"
-        if "." in file_name:
-            file_dict["file_type"] = file_name.split(".")[-1].lower()
+        file_dict["file_type"] = toolbox.extract_file_extension(file_name)
         # Ignore files starting with a dot
         if file_name.startswith("."):
             continue
@@ -95,9 +82,14 @@ def extract_data_from_figshare_zip_file(url):
     return file_lst
 
 
-def search_figshare_with_query(query, page=1, hits_per_page=1000):
+def search_figshare_with_query(
+    query, page=1, hits_per_page=1000, attempt_number=5, time_between_attempt=2
+):
     """Search for datasets.
 
+    Failed requests are retried on the same page, waiting twice as long
+    after each failed attempt.
+
     Arguments
     ---------
     query: str
@@ -106,22 +98,57 @@ def search_figshare_with_query(query, page=1, hits_per_page=1000):
         Page number.
     hits_per_page: int
         Number of hits per pages.
+    attempt_number : int
+        Number of attempts to get the page.
+        Default: 5
+    time_between_attempt : int
+        Number of seconds to wait after the first failed attempt.
+        Default: 2
 
     Returns
     -------
     dict
         Figshare response as a JSON object.
     """
-    HEADERS = {'content-type': 'application/json'}
-    response = requests.post(
-        "https://api.figshare.com/v2/articles/search",
-        data=f'\u007b"search_for": "{query}", "page_size":{hits_per_page}, "item_type":3, "page":{page}\u007d',
-        headers=HEADERS
-    )
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return None
+    # Build the request body once for all attempts.
+    # item_type 3 is for datasets.
+    payload = {
+        "search_for": query,
+        "page_size": hits_per_page,
+        "item_type": 3,
+        "page": page,
+    }
+    for attempt in range(1, attempt_number + 1):
+        response = None
+        try:
+            response = HTTP_SESSION.post(
+                f"{FIGSHARE_API_URL}/articles/search", json=payload
+            )
+        except Exception as exc:
+            print(f"\nCannot establish connection to {FIGSHARE_API_URL}")
+            print(f"Exception type: {exc.__class__}")
+            print(f"Exception message: {exc}")
+        else:
+            if response.status_code == 200:
+                return toolbox.decode_json_response(response)
+            print(f"\nError with page {page} of query: {query}")
+            print(f"Status code: {response.status_code}")
+        print(f"Attempt {attempt}/{attempt_number}")
+        # Client errors other than rate limiting will not go away on retry.
+        client_error = (
+            response is not None
+            and 400 <= response.status_code < 500
+            and response.status_code != 429
+        )
+        if attempt == attempt_number or client_error:
+            raise RuntimeError(
+                f"Cannot get page {page} of query: {query}. Aborting."
+            )
+        sleep_time = toolbox.get_retry_delay(
+            response, min(60, time_between_attempt * 2 ** (attempt - 1))
+        )
+        print(f"Will retry in {sleep_time} seconds")
+        time.sleep(sleep_time)
 
 
 def request_figshare_dataset_with_id(datasetID):
@@ -136,11 +163,16 @@ def request_figshare_dataset_with_id(datasetID):
     -------
     dict
         FigShare response as a JSON object.
+        None if the dataset cannot be fetched.
     """
-    response = requests.get(
-        f"https://api.figshare.com/v2/articles/{datasetID}"
+    response = HTTP_SESSION.get(
+        f"{FIGSHARE_API_URL}/articles/{datasetID}"
     )
-    return json.loads(response.content)
+    if response.status_code != 200:
+        print(f"\nCannot fetch dataset {datasetID}")
+        print(f"Status code: {response.status_code}")
+        return None
+    return toolbox.decode_json_response(response)
 
 
 def request_figshare_downloadstats_with_id(datasetID):
@@ -156,10 +188,10 @@ def request_figshare_downloadstats_with_id(datasetID):
     dict
         FigShare response as a JSON object.
     """
-    response = requests.get(
-        f"https://stats.figshare.com/total/downloads/article/{datasetID}"
+    response = HTTP_SESSION.get(
+        f"{FIGSHARE_STATS_URL}/downloads/article/{datasetID}"
     )
-    return json.loads(response.content)
+    return toolbox.decode_json_response(response)
 
 
 def request_figshare_viewstats_with_id(datasetID):
@@ -175,10 +207,10 @@ def request_figshare_viewstats_with_id(datasetID):
     dict
         FigShare response as a JSON object.
     """
-    response = requests.get(
-        f"https://stats.figshare.com/total/views/article/{datasetID}"
+    response = HTTP_SESSION.get(
+        f"{FIGSHARE_STATS_URL}/views/article/{datasetID}"
     )
-    return json.loads(response.content)
+    return toolbox.decode_json_response(response)
 
 
 def scrap_figshare_zip_content(files_df):
@@ -203,23 +235,28 @@ def scrap_figshare_zip_content(files_df):
         "Number of zip files to scrap content from: "
         f"{zip_files_df.shape[0]}"
     )
+    # According to Figshare support
+    # One can run 100 requests per 5 minutes.
+    # To be careful, we send at most 80 requests every 360 secondes.
+    sleep_time = 360
+    request_times = collections.deque(maxlen=80)
     for zip_idx in zip_files_df.index:
         zip_file = zip_files_df.loc[zip_idx]
-        file_id = zip_file['file_url'].split('/')[-1]
-        zip_counter += 1
-        # According to Figshare support
-        # One can run 100 requests per 5 minutes.
-        # To be careful, we wait 360 secondes every 80 requests.
-        sleep_time = 360
-        if zip_counter % 80 == 0:
+        file_id = zip_file['file_url'].rpartition('/')[2]
+        wait_time = toolbox.get_rate_limit_delay(
+            request_times, sleep_time, time.monotonic()
+        )
+        if wait_time > 0:
             print(
                 f"Scraped {zip_counter} zip files / "
                 f"{zip_files_df.shape[0]}\n"
-                f"Waiting for {sleep_time} seconds..."
+                f"Waiting for {wait_time:.0f} seconds..."
             )
-            time.sleep(sleep_time)
+            time.sleep(wait_time)
+        request_times.append(time.monotonic())
+        zip_counter += 1
         URL = (
-            f"https://figshare.com/ndownloader/files/{file_id}"
+            f"{FIGSHARE_DOWNLOAD_URL}/{file_id}"
             f"/preview/{file_id}/structure.json"
         )
         files_tmp = extract_data_from_figshare_zip_file(URL)
@@ -238,13 +275,64 @@ def scrap_figshare_zip_content(files_df):
     return files_in_zip_df
 
 
-def extract_records(hit):
+def scrap_figshare_dataset(dataset_id, modified_date, date_fetched, cache_dir=None):
+    """Fetch a FigShare dataset and extract its records.
+
+    When a cache directory is provided, the dataset description is cached
+    and reused as long as the dataset is not modified. Records are always
+    extracted again, with fresh statistics and fetch date.
+
+    Arguments
+    ---------
+    dataset_id: str
+        Dataset ID.
+    modified_date: str
+        Date of last modification of the dataset, as given by the search.
+        The dataset description is not cached if it is None.
+    date_fetched: str
+        Date the records are fetched, in ISO 8601.
+    cache_dir: str
+        Directory to cache dataset descriptions into.
+        Default: None (no cache)
+
+    Returns
+    -------
+    records: list
+        List of dictionnaries. Information on datasets.
+    texts: list
+        List of dictionnaries. Textual information on datasets
+    files: list
+        List of dictionnaies. Information on files.
+    """
+    # Without modification date, a cached description could never expire.
+    use_cache = cache_dir is not None and modified_date is not None
+    resp_json_article = None
+    if use_cache:
+        cache_file_path = toolbox.get_cache_file_path(
+            cache_dir, DATASET_ORIGIN, dataset_id, modified_date
+        )
+        resp_json_article = toolbox.read_cache_file(cache_file_path)
+    if resp_json_article is None:
+        resp_json_article = request_figshare_dataset_with_id(dataset_id)
+        if resp_json_article is None:
+            return [], [], []
+        # Only cache complete dataset descriptions.
+        if use_cache and "id" in resp_json_article:
+            toolbox.write_cache_file(
+                cache_file_path, json.dumps(resp_json_article).encode("utf-8")
+            )
+    return extract_records(resp_json_article, date_fetched)
+
+
+def extract_records(hit, date_fetched):
     """Extract information from the FigShare records.
 
     Arguments
     ---------
     response_json: dict
         JSON object obtained after a request on FigShare API.
+    date_fetched: str
+        Date the records are fetched, in ISO 8601.
 
     Returns
     -------
@@ -260,14 +348,16 @@ def extract_records(hit):
     files = []
     if hit["is_embargoed"] != False:
         return datasets, texts, files
+    # Metadata-only articles have no files.
+    hit_files = hit.get("files", ())
     dataset_dict = {
-        "dataset_origin": "figshare",
+        "dataset_origin": DATASET_ORIGIN,
         "dataset_id": str(hit["id"]),
         "doi": hit["doi"],
-        "date_creation": extract_date(hit["created_date"][:-1]),
-        "date_last_modified": extract_date(hit["modified_date"][:-1]),
-        "date_fetched": datetime.now().isoformat(timespec="seconds"),
-        "file_number": len(hit["files"]),
+        "date_creation": toolbox.extract_date(hit["created_date"][:-1]),
+        "date_last_modified": toolbox.extract_date(hit["modified_date"][:-1]),
+        "date_fetched": date_fetched,
+        "file_number": len(hit_files),
         "download_number": request_figshare_downloadstats_with_id(hit['id'])["totals"],
         "view_number": request_figshare_viewstats_with_id(hit['id'])["totals"],
         "license": hit["license"]["name"],
@@ -278,24 +368,20 @@ def extract_records(hit):
         "dataset_origin": dataset_dict["dataset_origin"],
         "dataset_id": dataset_dict["dataset_id"],
         "title": toolbox.clean_text(hit["title"]),
-        "author": toolbox.clean_text(hit["authors"][0]["full_name"]),
+        "author": toolbox.clean_short_text(hit["authors"][0]["full_name"]),
         "keywords": "",
         "description": toolbox.clean_text(hit["description"])
     }
     if "tags" in hit:
         text_dict["keywords"] = ";".join(
-            [str(toolbox.clean_text(keyword)) for keyword in hit["tags"]]
+            [str(toolbox.clean_short_text(keyword)) for keyword in hit["tags"]]
         )
     texts.append(text_dict)
-    for file_in in hit["files"]:
-        if len(file_in["name"].split('.'))==1:
-            filetype = "none"
-        else:
-            filetype = file_in["name"].split('.')[-1].lower()
+    for file_in in hit_files:
         file_dict = {
             "dataset_origin": dataset_dict["dataset_origin"],
             "dataset_id": dataset_dict["dataset_id"],
-            "file_type": filetype,
+            "file_type": toolbox.extract_file_extension(file_in["name"]),
             "file_size": file_in["size"],
             "file_md5": file_in["computed_md5"],
             "from_zip_file": False,
@@ -317,96 +403,124 @@ def main_scrap_figshare(arg, scrap_zip=False):
 
     # Verify results output directory
     toolbox.verify_output_directory(arg.output)
+    cache_dir = None
+    if arg.cache:
+        cache_dir = pathlib.Path(arg.output) / ".cache"
+    # All records of a scraping run share the same fetch date.
+    date_fetched = datetime.now().isoformat(timespec="seconds")
 
     # The best strategy is to use paging.
     MAX_HITS_PER_PAGE = 1000
 
-    datasets_df = pd.DataFrame()
-    texts_df = pd.DataFrame()
-    files_df = pd.DataFrame()
+    # Records are accumulated in lists and converted to dataframes
+    # once all queries are done.
+    datasets_lst = []
+    texts_lst = []
+    files_lst = []
     prev_datasets_count = 0
     prev_file_count = 0
-    for file_type in FILE_TYPES:
-        print(f"Looking for filetype: {file_type['type']}")
-        query_records = []
-        query_files = []
-        base_query = (
-            f':extension: {file_type["type"]}'
-        )
-        if file_type["keywords"] == "md_keywords":
-            add_keywords = len(MD_KEYWORDS)
-            print(f"Additional keywords for query: {', '.join(MD_KEYWORDS)}")
-        elif file_type["keywords"] == "generic_keywords":
-            add_keywords = len(GENERIC_KEYWORDS)
-            print(f"Additional keywords for query: {', '.join(GENERIC_KEYWORDS)}")
-        else:
-            add_keywords = 1
-        # Go through all keywords as query length for FigShare is limited
-        for keywordID in range(0,add_keywords):
+    # Ids of datasets already fetched, across all queries.
+    seen_dataset_ids = set()
+    # Each dataset requires several requests (record, downloads, views).
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=arg.max_workers
+    ) as executor:
+        for file_type in FILE_TYPES:
+            print(f"Looking for filetype: {file_type['type']}")
+            query_records = []
+            query_files = []
+            base_query = (
+                f':extension: {file_type["type"]}'
+            )
             if file_type["keywords"] == "md_keywords":
-                query = (
-                    f"{base_query} AND (:title: '{MD_KEYWORDS[keywordID]}' "
-                    f"OR :description: '{MD_KEYWORDS[keywordID]}' OR :keyword: '{MD_KEYWORDS[keywordID]}')"
-                )
+                keywords = MD_KEYWORDS
             elif file_type["keywords"] == "generic_keywords":
-                query = (
-                    f"{base_query} AND (:title: '{GENERIC_KEYWORDS[keywordID]}' "
-                    f"OR :description: '{GENERIC_KEYWORDS[keywordID]}' OR :keyword: '{GENERIC_KEYWORDS[keywordID]}')"
-                )
+                keywords = GENERIC_KEYWORDS
             else:
-                query = base_query
-            # print(f"Query:\n{query}")
-            # First get the total number of hits for a given query.
-            resp_json = search_figshare_with_query(
-               query, hits_per_page=1
-            )
-            # Then, slice the query by page.
-            page=1
-            while page!=0:
-                # print(f"Page: {page}")
-                resp_json = search_figshare_with_query(
-                    query, page=page, hits_per_page=MAX_HITS_PER_PAGE
+                keywords = []
+            if keywords:
+                print(f"Additional keywords for query: {', '.join(keywords)}")
+                queries = [
+                    f"{base_query} AND (:title: '{keyword}' "
+                    f"OR :description: '{keyword}' OR :keyword: '{keyword}')"
+                    for keyword in keywords
+                ]
+            else:
+                queries = [base_query]
+            # Go through all keywords as query length for FigShare is limited
+            for query in queries:
+                # print(f"Query:\n{query}")
+                # FigShare does not give the total number of hits:
+                # slice the query by page until an empty page is returned.
+                page=1
+                next_page = executor.submit(
+                    search_figshare_with_query,
+                    query,
+                    page=page,
+                    hits_per_page=MAX_HITS_PER_PAGE,
                 )
-                if len(resp_json)==0:
-                    # print("Max hits per query reached!")
-                    page = 0
-                else:
-                    page+=1
-                    # Go through all datasets
-                    # print(f"Number of datasets: {len(resp_json)}")
-                    resp_json = [json.loads(i) for i in set([json.dumps(i) for i in [dict(sorted(i.items())) for i in resp_json]])]
-                    for dataset in resp_json:
-                        dataset_id = dataset['id']
-                        if datasets_df.empty or not dataset_id in datasets_df['dataset_id']:
-                            resp_json_article = request_figshare_dataset_with_id(dataset_id)
-                            datasets_tmp, texts_tmp, files_tmp = extract_records(resp_json_article)
-                            # Merge datasets
-                            datasets_df_tmp = pd.DataFrame(datasets_tmp)
-                            datasets_df = pd.concat(
-                                [datasets_df, datasets_df_tmp], ignore_index=True
-                            )
-                            datasets_df.drop_duplicates(
-                                subset=["dataset_origin", "dataset_id"], keep="first", inplace=True)
-                            # Merge texts
-                            texts_df_tmp = pd.DataFrame(texts_tmp)
-                            texts_df = pd.concat(
-                                [texts_df, texts_df_tmp], ignore_index=True
-                            )
-                            texts_df.drop_duplicates(
-                                subset=["dataset_origin", "dataset_id"], keep="first", inplace=True)                            
-                            # Merge files
-                            files_df_tmp = pd.DataFrame(files_tmp)
-                            files_df = pd.concat([files_df, files_df_tmp], ignore_index=True)
-                            files_df.drop_duplicates(
-                                subset=["dataset_id", "file_name", "file_md5"], keep="first", inplace=True
-                            )
-
-        print(f"Number of datasets found: {len(datasets_df)-prev_datasets_count}")
-        print(f"Number of files found: {len(files_df)-prev_file_count}")
-        print("-" * 30)
-        prev_datasets_count = len(datasets_df)
-        prev_file_count = len(files_df)
-
+                while page!=0:
+                    # print(f"Page: {page}")
+                    resp_json = next_page.result()
+                    if len(resp_json)==0:
+                        # print("Max hits per query reached!")
+                        page = 0
+                    else:
+                        page+=1
+                        # Fetch the next page while the current one is processed
+                        next_page = executor.submit(
+                            search_figshare_with_query,
+                            query,
+                            page=page,
+                            hits_per_page=MAX_HITS_PER_PAGE,
+                        )
+                        # Go through all datasets
+                        # print(f"Number of datasets: {len(resp_json)}")
+                        # Skip duplicated hits and datasets already fetched
+                        # by previous queries.
+                        modified_dates = {
+                            dataset['id']: dataset.get('modified_date')
+                            for dataset in resp_json
+                        }
+                        dataset_ids = [
+                            dataset_id
+                            for dataset_id in modified_dates
+                            if dataset_id not in seen_dataset_ids
+                        ]
+                        seen_dataset_ids.update(dataset_ids)
+                        # Datasets are fetched concurrently and merged as they come
+                        records = executor.map(
+                            functools.partial(
+                                scrap_figshare_dataset,
+                                date_fetched=date_fetched,
+                                cache_dir=cache_dir,
+                            ),
+                            dataset_ids,
+                            [modified_dates[dataset_id] for dataset_id in dataset_ids],
+                        )
+                        for datasets_tmp, texts_tmp, files_tmp in records:
+                            datasets_lst += datasets_tmp
+                            texts_lst += texts_tmp
+                            files_lst += files_tmp
+
+            print(f"Number of datasets found: {len(datasets_lst)-prev_datasets_count}")
+            print(f"Number of files found: {len(files_lst)-prev_file_count}")
+            print("-" * 30)
+            prev_datasets_count = len(datasets_lst)
+            prev_file_count = len(files_lst)
+
+    # Merge datasets
+    datasets_df = pd.DataFrame(datasets_lst).drop_duplicates(
+        subset=["dataset_origin", "dataset_id"], keep="first"
+    )
+    # Merge dataset texts
+    texts_df = pd.DataFrame(texts_lst).drop_duplicates(
+        subset=["dataset_origin", "dataset_id"], keep="first"
+    )
+    # Merge files
+    files_df = pd.DataFrame(files_lst).drop_duplicates(
+        subset=["dataset_id", "file_name", "file_md5"], keep="first"
+    )
 
     print(f"Total number of datasets found: {datasets_df.shape[0]}")
     print(f"Total number of files found: {files_df.shape[0]}")
@@ -439,7 +553,9 @@ def main_scrap_figshare(arg, scrap_zip=False):
 if __name__ == "__main__":
     # Parse input arguments
     arg = toolbox.get_scraper_cli_arguments()
-    
+    # Keep one pooled connection per worker thread.
+    HTTP_SESSION = toolbox.create_http_session(pool_size=max(10, arg.max_workers))
+
     # Call extract main scrap function
     main_scrap_figshare(arg, scrap_zip=True)
 
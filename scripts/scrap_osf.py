@@ -1,18 +1,20 @@
 """Scrap molecular dynamics datasets and files from OSF."""
 
-import argparse
+import concurrent.futures
 from datetime import datetime
+import itertools
+import json
 import math
 import os
 import pathlib
+import sys
+import threading
 import time
 
 
-from bs4 import BeautifulSoup
 import dotenv
 import pandas as pd
 import tqdm
-import requests
 
 try:
     import toolbox
@@ -20,6 +22,18 @@ except ModuleNotFoundError:
     from . import toolbox
 
 
+DATASET_ORIGIN = "osf"
+OSF_API_URL = "https://api.osf.io/v2"
+OSF_URL = "https://osf.io"
+# Maximum number of results per page allowed by the OSF API.
+# The default is 10, which multiplies the number of requests by 10.
+OSF_PAGE_SIZE = 100
+# Reuse connections to the API between requests.
+HTTP_SESSION = toolbox.create_http_session()
+# The API call counter is incremented from worker threads.
+API_COUNTER_LOCK = threading.Lock()
+
+
 def read_osf_token():
     """Read OSF token from disk.
 
@@ -34,8 +48,8 @@ def read_osf_token():
 
 def query_osf_api(
     token="",
-    url="https://api.osf.io/v2/",
-    params={},
+    url=f"{OSF_API_URL}/",
+    params=None,
     attempt_number=3,
     time_between_attempt=3,
     print_status_on_success=False,
@@ -51,6 +65,7 @@ def query_osf_api(
         API endpoint
     params : dict, optional
         Parameters to pass to API endpoint.
+        Default: None
     attempt_number : int, optional
         Number of attempt to try connection.
         Default: 3
@@ -73,11 +88,12 @@ def query_osf_api(
     response = None
     while attempt <= attempt_number:
         try:
-            response = requests.get(
+            response = HTTP_SESSION.get(
                 url, params=params, headers={"Authorization": f"Bearer {token}"}
             )
             # Count the number of times the OSF API is called
-            query_osf_api.counter += 1
+            with API_COUNTER_LOCK:
+                query_osf_api.counter += 1
         except Exception as exc:
             print(f"\nCannot establish connection to {url}")
             print(f"Exception type: {exc.__class__}")
@@ -90,8 +106,9 @@ def query_osf_api(
             print(f"Status code: {response.status_code}")
             print(f"Attempt {attempt}/{attempt_number}")
             if attempt < attempt_number:
-                print(f"Will retry in {time_between_attempt} seconds")
-                time.sleep(time_between_attempt)
+                sleep_time = toolbox.get_retry_delay(response, time_between_attempt)
+                print(f"Will retry in {sleep_time} seconds")
+                time.sleep(sleep_time)
             else:
                 print("Cannot access ressource. Aborting.")
                 print(f"Headers: {response.headers}\n")
@@ -101,7 +118,7 @@ def query_osf_api(
         print(f"Status code: {response.status_code} -> success")
     if print_headers:
         print(response.headers)
-    return response.json()
+    return toolbox.decode_json_response(response)
 
 
 def test_osf_connection(token):
@@ -111,15 +128,27 @@ def test_osf_connection(token):
     ----------
     token : str
         Token for OSF API
+
+    Returns
+    -------
+    bool
+        True if the connection succeeded, False otherwise.
     """
     print("Trying connection to OSF...")
-    query_osf_api(
-        token=token, url="https://api.osf.io/v2/users/me/", print_status_on_success=True
+    resp_json = query_osf_api(
+        token=token, url=f"{OSF_API_URL}/users/me/", print_status_on_success=True
     )
+    return "error" not in resp_json
 
 
 def search_datasets(
-    token, file_types, query_md_keywords, query_generic_keywords, excluded_files, excluded_paths
+    token,
+    file_types,
+    query_md_keywords,
+    query_generic_keywords,
+    excluded_files,
+    excluded_paths,
+    max_workers=1,
 ):
     """Search datasets relevant to file types and keywords.
 
@@ -139,6 +168,9 @@ def search_datasets(
         Patterns for file exclusion.
     excluded_paths : list
         Patterns for path exclusion.
+    max_workers : int, optional
+        Maximum number of pages fetched at the same time.
+        Default: 1
 
     Returns
     -------
@@ -158,37 +190,94 @@ def search_datasets(
         print(f"Query:\n{query}")
         resp_json = query_osf_api(
             token=token,
-            url="https://api.osf.io/v2/search/files/",
-            params={"q": query, "page": 1},
+            url=f"{OSF_API_URL}/search/files/",
+            params={"q": query, "page": 1, "page[size]": OSF_PAGE_SIZE},
         )
         results_total = resp_json["links"]["meta"]["total"]
         results_per_page = resp_json["links"]["meta"]["per_page"]
         page_max = math.ceil(results_total / results_per_page)
-        pbar = tqdm.tqdm(
-            range(1, page_max + 1),
-            leave=True,
-            bar_format="{l_bar}{n_fmt}/{total_fmt} pages",
-        )
-        for page in pbar:
-            resp_json = query_osf_api(
-                token=token,
-                url="https://api.osf.io/v2/search/files/",
-                params={"q": query, "page": page},
+        # We already have the first page. Next pages are fetched concurrently.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            next_pages = executor.map(
+                lambda page: query_osf_api(
+                    token=token,
+                    url=f"{OSF_API_URL}/search/files/",
+                    params={"q": query, "page": page, "page[size]": OSF_PAGE_SIZE},
+                ),
+                range(2, page_max + 1),
+            )
+            pbar = tqdm.tqdm(
+                itertools.chain([resp_json], next_pages),
+                total=page_max,
+                leave=True,
+                bar_format="{l_bar}{n_fmt}/{total_fmt} pages",
             )
-            for file_info in resp_json["data"]:
-                if file_info["attributes"]["kind"] != "file":
-                    break
-                if not file_info["attributes"]["name"].endswith(file_type["type"]):
-                    break
-                if file_info["relationships"]["target"]["data"]["type"] == "nodes":
-                    datasets_tmp.add(file_info["relationships"]["target"]["data"]["id"])
+            for resp_json in pbar:
+                for file_info in resp_json["data"]:
+                    if file_info["attributes"]["kind"] != "file":
+                        break
+                    if not file_info["attributes"]["name"].endswith(file_type["type"]):
+                        break
+                    if file_info["relationships"]["target"]["data"]["type"] == "nodes":
+                        datasets_tmp.add(
+                            file_info["relationships"]["target"]["data"]["id"]
+                        )
         datasets.update(datasets_tmp)
         print(f"Found {len(datasets_tmp)} datasets (total unique: {len(datasets)})")
     print("-" * 30)
     return datasets
 
 
-def add_children_parent_datasets(token, dataset_ids):
+def find_children_parent_datasets(token, dataset_id):
+    """Find children and parent datasets of one dataset.
+
+    Parameters
+    ----------
+    token : str
+        Token for OSF API
+    dataset_id : str
+        Dataset id.
+
+    Returns
+    -------
+    set
+        Set of dataset ids, including the queried dataset.
+    """
+    # Add current dataset
+    dataset_ids_out = {dataset_id}
+    # Search children
+    page = 1
+    page_max = 2
+    while page <= page_max:
+        parameters = {"page": page, "page[size]": OSF_PAGE_SIZE}
+        api_json = query_osf_api(
+            token=token,
+            url=f"{OSF_API_URL}/nodes/{dataset_id}/children/",
+            params=parameters,
+        )
+        if "error" in api_json:
+            break
+        results_total = api_json["links"]["meta"]["total"]
+        results_per_page = api_json["links"]["meta"]["per_page"]
+        page_max = math.ceil(results_total / results_per_page)
+        for child in api_json["data"]:
+            if child["type"] == "nodes":
+                dataset_ids_out.add(child["id"])
+        page += 1
+    # Search parent
+    api_json = query_osf_api(token=token, url=f"{OSF_API_URL}/nodes/{dataset_id}/")
+    if "error" in api_json:
+        return dataset_ids_out
+    relationships = api_json["data"]["relationships"]
+    if (
+        "parent" in relationships
+        and relationships["parent"]["data"]["type"] == "nodes"
+    ):
+        dataset_ids_out.add(relationships["parent"]["data"]["id"])
+    return dataset_ids_out
+
+
+def add_children_parent_datasets(token, dataset_ids, max_workers=1):
     """Add children and parent datasets.
 
     API endpoint for children:
@@ -206,6 +295,9 @@ def add_children_parent_datasets(token, dataset_ids):
         Token for OSF API
     dataset_ids : set
         Datasets ids
+    max_workers : int, optional
+        Maximum number of datasets queried at the same time.
+        Default: 1
 
     Returns
     -------
@@ -214,46 +306,22 @@ def add_children_parent_datasets(token, dataset_ids):
     """
     dataset_ids_out = set()
     print("Looking for children and parent datasets")
-    pbar = tqdm.tqdm(
-        dataset_ids,
-        leave=False,
-        bar_format="{l_bar}{n_fmt}/{total_fmt}{postfix}",
-    )
-    for dataset_id in pbar:
-        pbar.set_postfix({"dataset": str(dataset_id)})
-        # Add current dataset
-        dataset_ids_out.add(dataset_id)
-        # Search children
-        page = 1
-        page_max = 2
-        while page <= page_max:
-            parameters = {"page": page}
-            api_json = query_osf_api(
-                token=token,
-                url=f"https://api.osf.io/v2/nodes/{dataset_id}/children/",
-                params=parameters,
-            )
-            if "error" in api_json:
-                break
-            results_total = api_json["links"]["meta"]["total"]
-            results_per_page = api_json["links"]["meta"]["per_page"]
-            page_max = math.ceil(results_total / results_per_page)
-            for child in api_json["data"]:
-                if child["type"] == "nodes":
-                    dataset_ids_out.add(child["id"])
-            page += 1
-        # Search parent
-        api_json = query_osf_api(
-            token=token, url=f"https://api.osf.io/v2/nodes/{dataset_id}/"
+    dataset_ids_in = list(dataset_ids)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            find_children_parent_datasets,
+            itertools.repeat(token),
+            dataset_ids_in,
         )
-        if "error" in api_json:
-            continue
-        relationships = api_json["data"]["relationships"]
-        if (
-            "parent" in relationships
-            and relationships["parent"]["data"]["type"] == "nodes"
-        ):
-            dataset_ids_out.add(relationships["parent"]["data"]["id"])
+        pbar = tqdm.tqdm(
+            zip(dataset_ids_in, results),
+            total=len(dataset_ids_in),
+            leave=False,
+            bar_format="{l_bar}{n_fmt}/{total_fmt}{postfix}",
+        )
+        for dataset_id, related_dataset_ids in pbar:
+            pbar.set_postfix({"dataset": str(dataset_id)}, refresh=False)
+            dataset_ids_out.update(related_dataset_ids)
     print(
         f"Found {len(dataset_ids_out)-len(dataset_ids)} new children / parent datasets"
     )
@@ -262,7 +330,72 @@ def add_children_parent_datasets(token, dataset_ids):
     return dataset_ids_out
 
 
-def query_datasets(token, datasets):
+def query_one_dataset(token, dataset_id, date_fetched):
+    """Index information of a single dataset.
+
+    Parameters
+    ----------
+    token : str
+        Token for OSF API
+    dataset_id : str
+        Dataset id.
+    date_fetched : str
+        Date the dataset is fetched, in ISO 8601.
+
+    Returns
+    -------
+    dataset_dict: dict
+        Information on dataset. None if the dataset cannot be accessed.
+    text_dict: dict
+        Textual information on dataset. None if the dataset cannot be accessed.
+    """
+    resp_json = query_osf_api(
+        token=token, url=f"{OSF_API_URL}/nodes/{dataset_id}/"
+    )
+    if "error" in resp_json:
+        return None, None
+    attributes = resp_json["data"]["attributes"]
+    dataset_dict = {
+        "dataset_origin": DATASET_ORIGIN,
+        "dataset_id": dataset_id,
+        "doi": "",
+        "date_creation": toolbox.extract_date(attributes["date_created"]),
+        "date_last_modified": toolbox.extract_date(attributes["date_modified"]),
+        "date_fetched": date_fetched,
+        "file_number": 0,
+        "download_number": 0,
+        "view_number": 0,
+        # "license": attributes["node_license"],
+        "license": "",
+        "dataset_url": f"{OSF_URL}/{dataset_id}/",
+    }
+    text_dict = {
+        "dataset_origin": DATASET_ORIGIN,
+        "dataset_id": dataset_id,
+        "title": toolbox.clean_text(attributes["title"]),
+        "author": "",
+        "keywords": "none",
+        "description": toolbox.clean_text(attributes["description"]),
+    }
+    if attributes["tags"]:
+        text_dict["keywords"] = ";".join(
+            [str(keyword) for keyword in attributes["tags"]]
+        )
+    # Get files URL
+    resp_json = query_osf_api(
+        token=token,
+        url=f"{OSF_API_URL}/nodes/{dataset_id}/files",
+    )
+    files_url = resp_json["data"][0]["relationships"]["files"]["links"]["related"][
+        "href"
+    ]
+    dataset_dict["files_url"] = files_url
+    # Full modification timestamp, used to invalidate cached file lists.
+    dataset_dict["date_modified"] = attributes["date_modified"]
+    return dataset_dict, text_dict
+
+
+def query_datasets(token, datasets, date_fetched, max_workers=1):
     """Index dataset informations.
 
     API endpoints:
@@ -270,12 +403,19 @@ def query_datasets(token, datasets):
     - file storage: https://api.osf.io/v2/nodes/{datasetid}/files/
     - file list (first level): https://api.osf.io/v2/nodes/{datasetid}/files/osfstorage/
 
+    Datasets are independent from each other and are queried concurrently.
+
     Parameters
     ----------
     token : str
         Token for OSF API
     datasets : set
         Datasets ids
+    date_fetched : str
+        Date the datasets are fetched, in ISO 8601.
+    max_workers : int, optional
+        Maximum number of datasets queried at the same time.
+        Default: 1
 
     Returns
     -------
@@ -287,87 +427,89 @@ def query_datasets(token, datasets):
     datasets_lst = []
     texts_lst = []
     print("Scraping datasets information")
-    pbar = tqdm.tqdm(
-        datasets,
-        leave=False,
-        bar_format="{l_bar}{n_fmt}/{total_fmt}{postfix}",
-    )
-    for dataset_id in pbar:
-        pbar.set_postfix({"dataset": str(dataset_id)})
-        resp_json = query_osf_api(
-            token=token, url=f"https://api.osf.io/v2/nodes/{dataset_id}/"
+    dataset_ids = list(datasets)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            query_one_dataset,
+            itertools.repeat(token),
+            dataset_ids,
+            itertools.repeat(date_fetched),
         )
-        if "error" in resp_json:
-            continue
-        dataset_dict = {
-            "dataset_origin": "osf",
-            "dataset_id": dataset_id,
-            "doi": "",
-            "date_creation": toolbox.extract_date(
-                resp_json["data"]["attributes"]["date_created"]
-            ),
-            "date_last_modified": toolbox.extract_date(
-                resp_json["data"]["attributes"]["date_modified"]
-            ),
-            "date_fetched": datetime.now().isoformat(timespec="seconds"),
-            "file_number": 0,
-            "download_number": 0,
-            "view_number": 0,
-            # "license": resp_json["data"]["attributes"]["node_license"],
-            "license": "",
-            "dataset_url": f"https://osf.io/{dataset_id}/",
-        }
-        datasets_lst.append(dataset_dict)
-        text_dict = {
-            "dataset_origin": "osf",
-            "dataset_id": dataset_id,
-            "title": toolbox.clean_text(resp_json["data"]["attributes"]["title"]),
-            "author": "",
-            "keywords": "none",
-            "description": toolbox.clean_text(
-                resp_json["data"]["attributes"]["description"]
-            ),
-        }
-        if resp_json["data"]["attributes"]["tags"]:
-            text_dict["keywords"] = ";".join(
-                [str(keyword) for keyword in resp_json["data"]["attributes"]["tags"]]
-            )
-        texts_lst.append(text_dict)
-        # Get files URL
-        resp_json = query_osf_api(
-            token=token,
-            url=f"https://api.osf.io/v2/nodes/{dataset_id}/files",
+        pbar = tqdm.tqdm(
+            zip(dataset_ids, results),
+            total=len(dataset_ids),
+            leave=False,
+            bar_format="{l_bar}{n_fmt}/{total_fmt}{postfix}",
         )
-        files_url = resp_json["data"][0]["relationships"]["files"]["links"]["related"][
-            "href"
-        ]
-        datasets_lst[-1]["files_url"] = files_url
+        for dataset_id, (dataset_dict, text_dict) in pbar:
+            pbar.set_postfix({"dataset": str(dataset_id)}, refresh=False)
+            if dataset_dict is None:
+                continue
+            datasets_lst.append(dataset_dict)
+            texts_lst.append(text_dict)
     print(f"Found information for {len(datasets_lst)} datasets")
     print("-" * 30)
     return datasets_lst, texts_lst
 
 
-def index_files_from_all_datasets(token, datasets_df):
+def index_files_from_all_datasets(token, datasets_df, max_workers=1, cache_dir=None):
+    """Index files from all datasets.
+
+    Datasets are independent from each other and are indexed concurrently.
+
+    Parameters
+    ----------
+    token : str
+        Token for OSF API.
+    datasets_df : Pandas dataframe
+        Datasets with their "dataset_id", "date_modified" and "files_url".
+    max_workers : int, optional
+        Maximum number of datasets indexed at the same time.
+        Default: 1
+    cache_dir : str, optional
+        Directory to cache file lists into.
+        Default: None (no cache)
+
+    Returns
+    -------
+    list
+        List of dictionnaries containing file descriptions.
+    """
     files_lst = []
     print("Indexing datasets files")
-    pbar = tqdm.tqdm(
-        datasets_df.index,
-        leave=True,
-        bar_format="{l_bar}{n_fmt}/{total_fmt}{postfix}",
-    )
-    for index in pbar:
-        dataset_id = datasets_df.loc[index, "dataset_id"]
-        pbar.set_postfix({"dataset": dataset_id})
-        url = datasets_df.loc[index, "files_url"]
-        files_lst += index_files_from_one_dataset(token, dataset_id, url)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            index_files_from_one_dataset,
+            itertools.repeat(token),
+            datasets_df["dataset_id"],
+            datasets_df["files_url"],
+            datasets_df["date_modified"],
+            itertools.repeat(cache_dir),
+        )
+        pbar = tqdm.tqdm(
+            zip(datasets_df["dataset_id"], results),
+            total=datasets_df.shape[0],
+            leave=True,
+            bar_format="{l_bar}{n_fmt}/{total_fmt}{postfix}",
+        )
+        for dataset_id, dataset_files_lst in pbar:
+            files_lst += dataset_files_lst
+            pbar.set_postfix(
+                {"dataset": dataset_id, "files": len(files_lst)}, refresh=False
+            )
     print(f"Found {len(files_lst)} files")
     print("-" * 30)
     return files_lst
 
 
-def index_files_from_one_dataset(token, dataset_id, dataset_files_url):
+def index_files_from_one_dataset(
+    token, dataset_id, dataset_files_url, date_modified="", cache_dir=None
+):
     """Index files from a single dataset.
 
+    When a cache directory is provided, the file list of a dataset is
+    cached and reused as long as the dataset is not modified.
+
     Parameters
     ----------
     token : str
@@ -378,13 +520,27 @@ def index_files_from_one_dataset(token, dataset_id, dataset_files_url):
     dataset_files_url : str
         API endpoint to start to index files.
         Example: "https://api.osf.io/v2/nodes/8xuaj/files/osfstorage/"
+    date_modified : str, optional
+        Timestamp of last modification of the dataset.
+        Example: "2020-07-29T13:42:17.123456"
+    cache_dir : str, optional
+        Directory to cache file lists into.
+        Default: None (no cache)
 
     Returns
     -------
     list
         List of dictionnaries containing file descriptions.
     """
+    if cache_dir:
+        cache_file_path = toolbox.get_cache_file_path(
+            cache_dir, "osf_files", dataset_id, date_modified
+        )
+        files_lst = toolbox.read_cache_file(cache_file_path)
+        if files_lst is not None:
+            return files_lst
     files_lst = []
+    is_complete = True
     query_urls_lst = [dataset_files_url]
     while query_urls_lst:
         target_url = query_urls_lst.pop(0)
@@ -392,50 +548,55 @@ def index_files_from_one_dataset(token, dataset_id, dataset_files_url):
         page = 1
         page_max = 1
         while page <= page_max:
-            parameters = {"page": page}
+            parameters = {"page": page, "page[size]": OSF_PAGE_SIZE}
             api_resp = query_osf_api(token, target_url, params=parameters)
             if "error" in api_resp:
+                is_complete = False
                 break
             results_total = api_resp["links"]["meta"]["total"]
             results_per_page = api_resp["links"]["meta"]["per_page"]
             page_max = math.ceil(results_total / results_per_page)
             for files in api_resp["data"]:
-                if files["attributes"]["kind"] == "folder":
+                attributes = files["attributes"]
+                if attributes["kind"] == "folder":
                     query_urls_lst.append(
                         files["relationships"]["files"]["links"]["related"]["href"]
                     )
-                if files["attributes"]["kind"] == "file":
+                elif attributes["kind"] == "file":
                     file_dict = {
-                        "dataset_origin": "osf",
+                        "dataset_origin": DATASET_ORIGIN,
                         "dataset_id": dataset_id,
-                        "file_type": toolbox.extract_file_extension(
-                            files["attributes"]["name"]
-                        ),
-                        "file_size": files["attributes"]["size"],  # File size in bytes.
-                        "file_md5": files["attributes"]["extra"]["hashes"]["md5"],
+                        "file_type": toolbox.extract_file_extension(attributes["name"]),
+                        "file_size": attributes["size"],  # File size in bytes.
+                        "file_md5": attributes["extra"]["hashes"]["md5"],
                         "from_zip_file": False,
-                        "file_name": files["attributes"]["materialized_path"],
+                        # Remove / at beginning of file path
+                        "file_name": attributes["materialized_path"].removeprefix("/"),
                         "file_url": files["links"]["download"],
                         "origin_zip_file": "none",
                     }
-                    # Remove / at beginning of file path
-                    if file_dict["file_name"].startswith("/"):
-                        file_dict["file_name"] = file_dict["file_name"][1:]
                     files_lst.append(file_dict)
             page += 1
-    print(f"\nFiles found in dataset {dataset_id}: {len(files_lst)}")
+    # Do not cache incomplete file lists.
+    if cache_dir and is_complete:
+        toolbox.write_cache_file(
+            cache_file_path, json.dumps(files_lst).encode("utf-8")
+        )
     return files_lst
 
 
 if __name__ == "__main__":
     ARGS = toolbox.get_scraper_cli_arguments()
+    # Keep one pooled connection per worker thread.
+    HTTP_SESSION = toolbox.create_http_session(pool_size=max(10, ARGS.max_workers))
 
     # Rest API call counter
     query_osf_api.counter = 0
 
     # Read OSF token
     OSF_TOKEN = read_osf_token()
-    test_osf_connection(OSF_TOKEN)
+    if not test_osf_connection(OSF_TOKEN):
+        sys.exit("Cannot connect to OSF API. Aborting.")
 
     # Read parameter file
     (
@@ -453,6 +614,11 @@ if __name__ == "__main__":
 
     # Verify output directory exists
     toolbox.verify_output_directory(ARGS.output)
+    CACHE_DIR = None
+    if ARGS.cache:
+        CACHE_DIR = pathlib.Path(ARGS.output) / ".cache"
+    # All records of a scraping run share the same fetch date.
+    DATE_FETCHED = datetime.now().isoformat(timespec="seconds")
 
     # Search datasets
     dataset_ids = search_datasets(
@@ -462,6 +628,7 @@ if __name__ == "__main__":
         QUERY_GENERIC_KEYWORDS,
         EXCLUDED_FILES,
         EXCLUDED_PATHS,
+        max_workers=ARGS.max_workers,
     )
 
     # dataset_ids = {'8xuaj', 'hk9f7', 'rnc6d', 'hsp5w', '3awds', 'p3gsq'}
@@ -470,17 +637,23 @@ if __name__ == "__main__":
     # In OSF, datasets are represented as "nodes"
     # some nodes have "children" and "parent" that are worth collecting
     # We run it twice to be as exhaustive as possible
-    dataset_ids = add_children_parent_datasets(OSF_TOKEN, dataset_ids)
-    dataset_ids = add_children_parent_datasets(OSF_TOKEN, dataset_ids)
+    dataset_ids = add_children_parent_datasets(
+        OSF_TOKEN, dataset_ids, max_workers=ARGS.max_workers
+    )
+    dataset_ids = add_children_parent_datasets(
+        OSF_TOKEN, dataset_ids, max_workers=ARGS.max_workers
+    )
 
     # Query datasets (called "nodes" in OSF)
-    datasets_lst, texts_lst = query_datasets(OSF_TOKEN, dataset_ids)
+    datasets_lst, texts_lst = query_datasets(
+        OSF_TOKEN, dataset_ids, DATE_FETCHED, max_workers=ARGS.max_workers
+    )
     datasets_df = pd.DataFrame(datasets_lst)
     texts_df = pd.DataFrame(texts_lst)
 
     # Save datasets dataframe to disk
     datasets_export_path = pathlib.Path(ARGS.output) / "osf_datasets.tsv"
-    datasets_df.drop(columns="files_url").to_csv(
+    datasets_df.drop(columns=["files_url", "date_modified"]).to_csv(
         datasets_export_path, sep="\t", index=False
     )
     print(f"Results saved in {str(datasets_export_path)}")
@@ -490,7 +663,9 @@ if __name__ == "__main__":
     print(f"Results saved in {str(texts_export_path)}")
 
     # Query files
-    files_lst = index_files_from_all_datasets(OSF_TOKEN, datasets_df)
+    files_lst = index_files_from_all_datasets(
+        OSF_TOKEN, datasets_df, max_workers=ARGS.max_workers, cache_dir=CACHE_DIR
+    )
     files_df = pd.DataFrame(files_lst)
 
     # Save files dataframe to disk
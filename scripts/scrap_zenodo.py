@@ -1,21 +1,32 @@
 """Scrap molecular dynamics datasets and files from Zenodo."""
 
+import collections
+import concurrent.futures
 from datetime import datetime
-from json import tool
+import functools
+import math
 import os
 import pathlib
+import sys
 import time
 
 
 from bs4 import BeautifulSoup
 import dotenv
 import pandas as pd
-import requests
 
 
 import toolbox
 
 
+DATASET_ORIGIN = "zenodo"
+ZENODO_API_URL = "https://zenodo.org/api"
+ZENODO_RECORD_URL = "https://zenodo.org/record"
+
+# Reuse connections to the API between requests.
+HTTP_SESSION = toolbox.create_http_session()
+
+
 def normalize_file_size(file_str):
     """Normalize file size in bytes.
 
@@ -59,7 +70,7 @@ def extract_data_from_zip_file(url, token):
     list
         List of dictionnaries with data extracted from zip preview.
     """
-    response = requests.get(url, params={"access_token": token})
+    response = HTTP_SESSION.get(url, params={"access_token": token})
 
     if response.status_code != 200:
         print(f"Error with URL: {url}")
@@ -118,12 +129,18 @@ def test_zenodo_connection(token, show_headers=False):
     ----------
     token : str
         Token for Zenodo API
+
+    Returns
+    -------
+    bool
+        True if the connection succeeded, False otherwise.
     """
     print("Trying connection to Zenodo...")
-    # Basic Zenodo query
-    response = requests.get(
-        "https://zenodo.org/api/deposit/depositions",
-        params={"access_token": token},
+    # Basic Zenodo query.
+    # Only the status code matters: ask for a single deposition.
+    response = HTTP_SESSION.get(
+        f"{ZENODO_API_URL}/deposit/depositions",
+        params={"access_token": token, "size": 1},
     )
     # Status code should be 200
     print(f"Status code: {response.status_code}", end="")
@@ -133,11 +150,24 @@ def test_zenodo_connection(token, show_headers=False):
         print(" failed!")
     if show_headers:
         print(response.headers)
-
-
-def search_zenodo_with_query(query, token, page=1, hits_per_page=10):
+    return response.status_code == 200
+
+
+def search_zenodo_with_query(
+    query,
+    token,
+    page=1,
+    hits_per_page=10,
+    total_hits=None,
+    cache_dir=None,
+    attempt_number=5,
+    time_between_attempt=2,
+):
     """Search for datasets.
 
+    Failed requests are retried on the same page, waiting twice as long
+    after each failed attempt.
+
     Arguments
     ---------
     query: str
@@ -148,23 +178,67 @@ def search_zenodo_with_query(query, token, page=1, hits_per_page=10):
         Page number.
     hits_per_page: int
         Number of hits per pages.
+    total_hits: int
+        Total number of hits of the query. Part of the cache key, so
+        that cached pages are not reused once the results have changed.
+        Default: None
+    cache_dir: str
+        Directory to cache responses into.
+        Default: None (no cache)
+    attempt_number : int
+        Number of attempts to get the page.
+        Default: 5
+    time_between_attempt : int
+        Number of seconds to wait after the first failed attempt.
+        Default: 2
 
     Returns
     -------
     dict
         Zenodo response as a JSON object.
     """
-    response = requests.get(
-        "https://zenodo.org/api/records",
-        params={
-            "q": query,
-            "size": hits_per_page,
-            "page": page,
-            "status": "published",
-            "access_token": token,
-        },
-    )
-    return response.json()
+    if cache_dir:
+        cache_file_path = toolbox.get_cache_file_path(
+            cache_dir, DATASET_ORIGIN, query, page, hits_per_page, total_hits
+        )
+        resp_json = toolbox.read_cache_file(cache_file_path)
+        if resp_json is not None:
+            return resp_json
+    for attempt in range(1, attempt_number + 1):
+        response = None
+        try:
+            response = HTTP_SESSION.get(
+                f"{ZENODO_API_URL}/records",
+                params={
+                    "q": query,
+                    "size": hits_per_page,
+                    "page": page,
+                    "status": "published",
+                    "access_token": token,
+                },
+            )
+        except Exception as exc:
+            print(f"\nCannot establish connection to {ZENODO_API_URL}")
+            print(f"Exception type: {exc.__class__}")
+            print(f"Exception message: {exc}")
+        else:
+            if response.status_code == 200:
+                break
+            print(f"\nError with page {page} of query: {query}")
+            print(f"Status code: {response.status_code}")
+        print(f"Attempt {attempt}/{attempt_number}")
+        if attempt == attempt_number:
+            raise RuntimeError(
+                f"Cannot get page {page} of query: {query}. Aborting."
+            )
+        sleep_time = toolbox.get_retry_delay(
+            response, min(60, time_between_attempt * 2 ** (attempt - 1))
+        )
+        print(f"Will retry in {sleep_time} seconds")
+        time.sleep(sleep_time)
+    if cache_dir:
+        toolbox.write_cache_file(cache_file_path, response.content)
+    return toolbox.decode_json_response(response)
 
 
 def scrap_zip_content(files_df):
@@ -189,50 +263,60 @@ def scrap_zip_content(files_df):
     files_in_zip_lst = []
     zip_counter = 0
     zip_files_df = files_df[files_df["file_type"] == "zip"]
-    print("Number of zip files to scrap content from: " f"{zip_files_df.shape[0]}")
-    for zip_idx in zip_files_df.index:
-        zip_file = zip_files_df.loc[zip_idx]
-        zip_counter += 1
-        # According to Zenodo documentation.
-        # https://developers.zenodo.org/#rate-limiting
-        # One can run 60 or 100 requests per minute.
-        # To be careful, we wait 60 secondes every 60 requests.
-        sleep_time = 60
-        if zip_counter % 60 == 0:
+    zip_files_number = zip_files_df.shape[0]
+    print("Number of zip files to scrap content from: " f"{zip_files_number}")
+    # According to Zenodo documentation.
+    # https://developers.zenodo.org/#rate-limiting
+    # One can run 60 or 100 requests per minute.
+    # To be careful, we send at most 60 requests every 60 secondes.
+    sleep_time = 60
+    request_times = collections.deque(maxlen=60)
+    for zip_file in zip_files_df.itertuples(index=False):
+        wait_time = toolbox.get_rate_limit_delay(
+            request_times, sleep_time, time.monotonic()
+        )
+        if wait_time > 0:
             print(
                 f"Scraped {zip_counter} zip files / "
-                f"{zip_files_df.shape[0]}\n"
-                f"Waiting for {sleep_time} seconds..."
+                f"{zip_files_number}\n"
+                f"Waiting for {wait_time:.0f} seconds..."
             )
-            time.sleep(sleep_time)
+            time.sleep(wait_time)
+        request_times.append(time.monotonic())
+        zip_counter += 1
         URL = (
-            f"https://zenodo.org/record/{zip_file['dataset_id']}"
-            f"/preview/{zip_file.loc['file_name']}"
+            f"{ZENODO_RECORD_URL}/{zip_file.dataset_id}"
+            f"/preview/{zip_file.file_name}"
         )
         # print(zip_counter, URL)
         files_tmp = extract_data_from_zip_file(URL, ZENODO_TOKEN)
         if files_tmp == []:
             continue
         # Add common extra fields
-        for idx in range(len(files_tmp)):
-            files_tmp[idx]["dataset_origin"] = zip_file.loc["dataset_origin"]
-            files_tmp[idx]["dataset_id"] = zip_file["dataset_id"]
-            files_tmp[idx]["from_zip_file"] = True
-            files_tmp[idx]["origin_zip_file"] = zip_file.loc["file_name"]
-            files_tmp[idx]["file_url"] = ""
-            files_tmp[idx]["file_md5"] = ""
+        common_fields = {
+            "dataset_origin": zip_file.dataset_origin,
+            "dataset_id": zip_file.dataset_id,
+            "from_zip_file": True,
+            "origin_zip_file": zip_file.file_name,
+            "file_url": "",
+            "file_md5": "",
+        }
+        for file_dict in files_tmp:
+            file_dict.update(common_fields)
         files_in_zip_lst += files_tmp
     files_in_zip_df = pd.DataFrame(files_in_zip_lst)
     return files_in_zip_df
 
 
-def extract_records(response_json):
+def extract_records(response_json, date_fetched):
     """Extract information from the Zenodo records.
 
     Arguments
     ---------
     response_json: dict
         JSON object obtained after a request on Zenodo API.
+    date_fetched: str
+        Date the records are fetched, in ISO 8601.
 
     Returns
     -------
@@ -248,41 +332,44 @@ def extract_records(response_json):
     files = []
     if response_json["hits"]["hits"]:
         for hit in response_json["hits"]["hits"]:
-            if hit["metadata"]["access_right"] != "open":
+            metadata = hit["metadata"]
+            if metadata["access_right"] != "open":
                 continue
             dataset_id = str(hit["id"])
+            # Metadata-only records have no files.
+            hit_files = hit.get("files", ())
             dataset_dict = {
-                "dataset_origin": "zenodo",
+                "dataset_origin": DATASET_ORIGIN,
                 "dataset_id": dataset_id,
                 "doi": hit["doi"],
                 "date_creation": toolbox.extract_date(hit["created"]),
                 "date_last_modified": toolbox.extract_date(hit["updated"]),
-                "date_fetched": datetime.now().isoformat(timespec="seconds"),
-                "file_number": len(hit["files"]),
+                "date_fetched": date_fetched,
+                "file_number": len(hit_files),
                 "download_number": int(hit["stats"]["downloads"]),
                 "view_number": int(hit["stats"]["views"]),
-                "license": hit["metadata"]["license"]["id"],
-                "dataset_url": f"https://zenodo.org/record/{dataset_id}",
+                "license": metadata["license"]["id"],
+                "dataset_url": f"{ZENODO_RECORD_URL}/{dataset_id}",
             }
             datasets.append(dataset_dict)
             text_dict = {
                 "dataset_origin": dataset_dict["dataset_origin"],
                 "dataset_id": dataset_dict["dataset_id"],
-                "title": toolbox.clean_text(hit["metadata"]["title"]),
-                "author": toolbox.clean_text(hit["metadata"]["creators"][0]["name"]),
+                "title": toolbox.clean_text(metadata["title"]),
+                "author": toolbox.clean_short_text(metadata["creators"][0]["name"]),
                 "keywords": "none",
-                "description": toolbox.clean_text(hit["metadata"]["description"]),
+                "description": toolbox.clean_text(metadata["description"]),
             }
-            if "keywords" in hit["metadata"]:
+            if "keywords" in metadata:
                 text_dict["keywords"] = ";".join(
-                    [str(keyword) for keyword in hit["metadata"]["keywords"]]
+                    [str(keyword) for keyword in metadata["keywords"]]
                 )
             # Handle existing but empty keywords.
             # For instance: https://zenodo.org/record/3741678
             if text_dict["keywords"] == "":
                 text_dict["keywords"] = "none"
             texts.append(text_dict)
-            for file_in in hit["files"]:
+            for file_in in hit_files:
                 file_dict = {
                     "dataset_origin": dataset_dict["dataset_origin"],
                     "dataset_id": dataset_dict["dataset_id"],
@@ -300,10 +387,13 @@ def extract_records(response_json):
 
 if __name__ == "__main__":
     ARGS = toolbox.get_scraper_cli_arguments()
+    # Keep one pooled connection per worker thread.
+    HTTP_SESSION = toolbox.create_http_session(pool_size=max(10, ARGS.max_workers))
 
     # Read Zenodo token
     ZENODO_TOKEN = read_zenodo_token()
-    test_zenodo_connection(ZENODO_TOKEN)
+    if not test_zenodo_connection(ZENODO_TOKEN):
+        sys.exit("Cannot connect to Zenodo API. Aborting.")
 
     # Read parameter file
     (
@@ -321,6 +411,11 @@ if __name__ == "__main__":
 
     # Verify output directory exists
     toolbox.verify_output_directory(ARGS.output)
+    CACHE_DIR = None
+    if ARGS.cache:
+        CACHE_DIR = pathlib.Path(ARGS.output) / ".cache"
+    # All records of a scraping run share the same fetch date.
+    DATE_FETCHED = datetime.now().isoformat(timespec="seconds")
 
     # There is a hard limit of the number of hits
     # one can get from a single query.
@@ -329,9 +424,11 @@ if __name__ == "__main__":
     # The best strategy is to use paging.
     MAX_HITS_PER_PAGE = 1_000
 
-    datasets_df = pd.DataFrame()
-    texts_df = pd.DataFrame()
-    files_df = pd.DataFrame()
+    # Records are accumulated in lists and converted to dataframes
+    # once all queries are done.
+    datasets_lst = []
+    texts_lst = []
+    files_lst = []
     for file_type in FILE_TYPES:
         print(f"Looking for filetype: {file_type['type']}")
         query_records = []
@@ -346,39 +443,57 @@ if __name__ == "__main__":
         resp_json = search_zenodo_with_query(query, ZENODO_TOKEN, hits_per_page=1)
         total_hits = resp_json["hits"]["total"]
         print(f"Number of hits: {total_hits}")
-        page_max = total_hits // MAX_HITS_PER_PAGE + 1
+        page_max = math.ceil(total_hits / MAX_HITS_PER_PAGE)
+        if page_max * MAX_HITS_PER_PAGE > MAX_HITS_PER_QUERY:
+            print("Max hits per query reached!")
+            page_max = MAX_HITS_PER_QUERY // MAX_HITS_PER_PAGE
+        print(f"Number of pages: {page_max}")
         # Then, slice the query by page.
-        for page in range(1, page_max + 1):
-            print(f"Page: {page}")
-            resp_json = search_zenodo_with_query(
-                query, ZENODO_TOKEN, page=page, hits_per_page=MAX_HITS_PER_PAGE
-            )
-            datasets_tmp, texts_tmp, files_tmp = extract_records(resp_json)
-            # Merge datasets
-            datasets_df_tmp = pd.DataFrame(datasets_tmp)
-            datasets_df = pd.concat([datasets_df, datasets_df_tmp], ignore_index=True)
-            datasets_df.drop_duplicates(
-                subset=["dataset_origin", "dataset_id"], keep="first", inplace=True
+        # Pages are independent from each other once the number of hits
+        # is known, so they are fetched concurrently.
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=ARGS.max_workers
+        ) as executor:
+            responses = executor.map(
+                functools.partial(
+                    search_zenodo_with_query,
+                    query,
+                    ZENODO_TOKEN,
+                    hits_per_page=MAX_HITS_PER_PAGE,
+                    total_hits=total_hits,
+                    cache_dir=CACHE_DIR,
+                ),
+                range(1, page_max + 1),
             )
-            # Merge dataset texts
-            texts_df_tmp = pd.DataFrame(texts_tmp)
-            texts_df = pd.concat([texts_df, texts_df_tmp], ignore_index=True)
-            texts_df.drop_duplicates(
-                subset=["dataset_origin", "dataset_id"], keep="first", inplace=True
+            pages = list(responses)
+        datasets_count = 0
+        files_count = 0
+        for resp_json in pages:
+            datasets_tmp, texts_tmp, files_tmp = extract_records(
+                resp_json, DATE_FETCHED
             )
-            # Merge files
-            files_df_tmp = pd.DataFrame(files_tmp)
-            files_df = pd.concat([files_df, files_df_tmp], ignore_index=True)
-            files_df.drop_duplicates(
-                subset=["dataset_id", "file_name"], keep="first", inplace=True
-            )
-            if page * MAX_HITS_PER_PAGE >= MAX_HITS_PER_QUERY:
-                print("Max hits per query reached!")
-                break
-        print(f"Number of datasets found: {len(datasets_tmp)}")
-        print(f"Number of files found: {len(files_tmp)}")
+            datasets_lst += datasets_tmp
+            texts_lst += texts_tmp
+            files_lst += files_tmp
+            datasets_count += len(datasets_tmp)
+            files_count += len(files_tmp)
+        print(f"Number of datasets found: {datasets_count}")
+        print(f"Number of files found: {files_count}")
         print("-" * 30)
 
+    # Merge datasets
+    datasets_df = pd.DataFrame(datasets_lst).drop_duplicates(
+        subset=["dataset_origin", "dataset_id"], keep="first"
+    )
+    # Merge dataset texts
+    texts_df = pd.DataFrame(texts_lst).drop_duplicates(
+        subset=["dataset_origin", "dataset_id"], keep="first"
+    )
+    # Merge files
+    files_df = pd.DataFrame(files_lst).drop_duplicates(
+        subset=["dataset_id", "file_name"], keep="first"
+    )
+
     print(f"Total number of datasets found: {datasets_df.shape[0]}")
     print(f"Total number of files found: {files_df.shape[0]}")
     # Save datasets dataframe to disk
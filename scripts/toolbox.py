@@ -2,14 +2,29 @@
 
 import argparse
 from datetime import datetime
+import functools
+import hashlib
+import os
 import pathlib
 import re
+import tempfile
 import warnings
 
 from bs4 import BeautifulSoup
 import pandas as pd
+import requests
 import yaml
 
+# orjson decodes JSON significantly faster than the standard library.
+# Fall back to the standard library if it is not installed.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Tabulations and carriage returns, or runs of several blank characters.
+REGEX_BLANKS = re.compile(r"[\n\r\t ]{2,}|[\n\r\t]")
+
 
 warnings.filterwarnings(
     "ignore",
@@ -44,9 +59,189 @@ def get_scraper_cli_arguments():
         help="Path to save results",
         required=True,
     )
+    parser.add_argument(
+        "-w",
+        "--max-workers",
+        action="store",
+        type=int,
+        help="Maximum number of concurrent requests to the API (default: 4)",
+        default=4,
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Cache API responses on disk (in OUTPUT/.cache) to speed up reruns",
+        default=False,
+    )
     return parser.parse_args()
 
 
+def create_http_session(pool_size=10):
+    """Create an HTTP session with a pool of persistent connections.
+
+    Connections are kept alive and reused between requests sent to the same
+    host, which avoids a new TCP and TLS handshake for every API call.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Maximum number of connections kept alive per host.
+        Default: 10
+
+    Returns
+    -------
+    requests.Session
+        HTTP session.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def decode_json_response(response):
+    """Decode the JSON content of an API response.
+
+    JSON is decoded straight from the raw bytes of the response,
+    without building the intermediate text string.
+
+    Parameters
+    ----------
+    response : requests.Response
+        Response of an API request.
+
+    Returns
+    -------
+    dict or list
+        Decoded JSON content.
+    """
+    return json_loads(response.content)
+
+
+def get_retry_delay(response, default_delay):
+    """Get the number of seconds to wait before retrying a request.
+
+    APIs answering with a rate limit error (HTTP 429) can tell in the
+    Retry-After header how long to wait before the next request.
+
+    Parameters
+    ----------
+    response : requests.Response
+        Response of the failed request. None if no response was received.
+    default_delay : int
+        Number of seconds to wait when the API does not provide one.
+
+    Returns
+    -------
+    int
+        Number of seconds to wait.
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return int(retry_after)
+    return default_delay
+
+
+def get_rate_limit_delay(request_times, time_window, current_time):
+    """Get the number of seconds to wait before the next request.
+
+    The rate limit allows at most `request_times.maxlen` requests
+    in any span of `time_window` seconds.
+
+    Parameters
+    ----------
+    request_times : collections.deque
+        Times of the last requests, as given by time.monotonic().
+        Its maximum length is the number of requests allowed per time window.
+    time_window : float
+        Duration of the time window, in seconds.
+    current_time : float
+        Current time, as given by time.monotonic().
+
+    Returns
+    -------
+    float
+        Number of seconds to wait.
+    """
+    if len(request_times) < request_times.maxlen:
+        return 0
+    # Wait for the oldest request to leave the time window.
+    return max(0, request_times[0] + time_window - current_time)
+
+
+def get_cache_file_path(cache_dir, *keys):
+    """Build the path of a cache file.
+
+    Parameters
+    ----------
+    cache_dir : str or pathlib.Path
+        Path to the cache directory.
+    *keys : str
+        Keys identifying the cached content, e.g. a query and a page number.
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the cache file.
+    """
+    key = "|".join(str(key) for key in keys)
+    file_name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return pathlib.Path(cache_dir) / f"{file_name}.json"
+
+
+def read_cache_file(cache_file_path):
+    """Read JSON content from a cache file.
+
+    Parameters
+    ----------
+    cache_file_path : pathlib.Path
+        Path of the cache file.
+
+    Returns
+    -------
+    dict or list or None
+        Cached JSON content, or None if the content is not cached yet
+        or cannot be decoded.
+    """
+    if not cache_file_path.is_file():
+        return None
+    # orjson and json decoding errors both derive from ValueError.
+    try:
+        return json_loads(cache_file_path.read_bytes())
+    except ValueError:
+        return None
+
+
+def write_cache_file(cache_file_path, content):
+    """Write JSON content to a cache file.
+
+    Content is written to a temporary file first, then moved onto the
+    cache file, so that an interrupted run never leaves a truncated file.
+
+    Parameters
+    ----------
+    cache_file_path : pathlib.Path
+        Path of the cache file.
+    content : bytes
+        Raw JSON content.
+    """
+    cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_descriptor, tmp_file_path = tempfile.mkstemp(
+        dir=cache_file_path.parent, suffix=".tmp"
+    )
+    try:
+        with os.fdopen(file_descriptor, "wb") as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_file_path, cache_file_path)
+    except BaseException:
+        os.remove(tmp_file_path)
+        raise
+
+
 def read_query_file(query_file_path):
     """Read the query definition file
 
@@ -118,11 +313,28 @@ def clean_text(string):
     # text_decode = BeautifulSoup(string, features="lxml")
     # text_decode = u''.join(text_decode.findAll(text=True))
     text_decode = BeautifulSoup(string, features="lxml").text
-    # Remove tabulation and carriage return
-    text_decode = re.sub(r"[\n\r\t]", " ", text_decode)
-    # Remove multi spaces
-    text_decode = re.sub(" {2,}", " ", text_decode)
-    return text_decode
+    # Remove tabulation, carriage return and multi spaces in a single pass
+    return REGEX_BLANKS.sub(" ", text_decode)
+
+
+@functools.lru_cache(maxsize=4096)
+def clean_short_text(string):
+    """Decodes from html and removes breaks, with caching.
+
+    Keywords and author names are short and repeated across many datasets.
+    Results are cached to avoid parsing the same string again.
+
+    Arguments
+    ---------
+    string: str
+        input string
+
+    Returns
+    -------
+    str
+        decoded string.
+    """
+    return clean_text(string)
 
 
 def extract_file_extension(file_path):
@@ -141,11 +353,11 @@ def extract_file_extension(file_path):
         Example: "txt"
     """
     # Extract the file name for its path.
-    file_name = file_path.split("/")[-1]
-    file_type = "none"
-    if "." in file_name:
-        file_type = file_name.split(".")[-1].lower()
-    return file_type
+    file_name = file_path.rpartition("/")[2]
+    _, dot, file_type = file_name.rpartition(".")
+    if not dot:
+        return "none"
+    return file_type.lower()
 
 
 def extract_date(date_str):
@@ -163,8 +375,7 @@ def extract_date(date_str):
         Date as in string in YYYY-MM-DD format.
         For example: 2020-07-29
     """
-    date = datetime.fromisoformat(date_str)
-    return f"{date:%Y-%m-%d}"
+    return datetime.fromisoformat(date_str).date().isoformat()
 
 
 def remove_excluded_files(files_df, exclusion_files, exclusion_paths):
@@ -188,24 +399,24 @@ def remove_excluded_files(files_df, exclusion_files, exclusion_paths):
     Pandas dataframe
         Dataframe without excluded files and paths.
     """
-    df_tmp = files_df.copy(deep=True)
+    file_paths = files_df["file_name"]
     # For file names with path, extract file name only:
-    df_tmp["name"] = df_tmp["file_name"].apply(lambda x: x.split("/")[-1])
+    file_names = file_paths.str.rsplit("/", n=1).str[-1]
 
     boolean_mask = pd.Series(data=False, index=files_df.index)
 
     for pattern in exclusion_paths:
         print(f"Selecting file paths containing: {pattern}")
-        selection = df_tmp["file_name"].str.contains(pat=pattern, regex=False)
-        print(f"Found {sum(selection)} files")
+        selection = file_paths.str.contains(pat=pattern, regex=False)
+        print(f"Found {selection.sum()} files")
         boolean_mask = boolean_mask | selection
 
     for pattern in exclusion_files:
         print(f"Selecting file names starting with: {pattern}")
-        selection = df_tmp["name"].str.startswith(pattern)
-        print(f"Found {sum(selection)} files")
+        selection = file_names.str.startswith(pattern)
+        print(f"Found {selection.sum()} files")
         boolean_mask = boolean_mask | selection
 
-    print(f"Removed {sum(boolean_mask)} excluded files")
-    print(f"Remaining files: {sum(~boolean_mask)}")
+    print(f"Removed {boolean_mask.sum()} excluded files")
+    print(f"Remaining files: {(~boolean_mask).sum()}")
     return files_df[~boolean_mask]